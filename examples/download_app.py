@@ -27,6 +27,7 @@ __author__ = "CoolCat467"
 __version__ = "0.0.0"
 __license__ = "GNU General Public License Version 3"
 
+import pathlib
 import re
 
 import httpx
@@ -39,42 +40,54 @@ from market_api import (
     get_publication,
 )
 
+MULTI_SLASH_REGEX = re.compile(r"/+")
+
 
 def fs_remove_slashes(path: str) -> str:
     """Remove extra slashes from path."""
-    return "/".join(x for x in path.split("/") if x)
+    return MULTI_SLASH_REGEX.sub("/", path).strip("/")
 
 
 def fs_path(path: str) -> str:
     """Return path but remove file from end if exists."""
-    if not path.endswith("/"):
-        return path.rsplit("/", 1)[0]
-    return path
+    if path.endswith("/"):
+        return path
+    head, sep, _ = path.rpartition("/")
+    return head if sep else path
 
 
-APP_PATH_REGEX = re.compile(r"\.[awlp]+\/+Main\.lua")
+APP_PATH_REGEX = re.compile(r"\.[awlp]+/+Main\.lua$")
 
 
 def get_application_path_from_version(versions_path: str) -> str:
     """Return application path."""
-    if APP_PATH_REGEX.match(versions_path):
+    # Cheap check first, most paths are not application main files
+    if not versions_path.endswith("Main.lua"):
+        return versions_path
+    if APP_PATH_REGEX.search(versions_path):
         return fs_path(versions_path)
     return versions_path
 
 
-DOWNLOAD_PATHS = {
-    1: "Applications/",
-    2: "Libraries/",
-    3: "",
-    4: "Wallpapers/",
-}
+# Indexed by publication category id, index 0 is unused
+DOWNLOAD_PATHS = (
+    "",
+    "Applications/",
+    "Libraries/",
+    "",
+    "Wallpapers/",
+)
 
 
 def get_dependency_path(main_file_path: str, dependency: Dependency) -> str:
     """Return dependency path."""
     # If is publication
     if dependency.publication_name:
-        path = DOWNLOAD_PATHS[dependency.category_id] + dependency.path
+        category_id = dependency.category_id
+        # Negative ids would index from the end instead of failing
+        if category_id is not None and category_id < 0:
+            raise IndexError(f"Unknown category id {category_id}")
+        path = DOWNLOAD_PATHS[category_id] + dependency.path
     else:  # Is resource
         # Absolute path
         if dependency.path.startswith("/"):
@@ -89,43 +102,85 @@ def get_dependency_path(main_file_path: str, dependency: Dependency) -> str:
     return fs_remove_slashes(path)
 
 
-MK_FILES_LOCK = trio.Lock()
+# Bytes collected from a download before writing them to disk.
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Directories already made by `download_mineos`, so files sharing a parent
+# directory only need one mkdir. Two downloads may both miss and both
+# call mkdir, which is harmless because of exist_ok.
+CREATED_DIRECTORIES: set[trio.Path] = set()
+
+
+# Maximum number of files downloading at once, the rest wait their turn
+# instead of all fighting over sockets and pooled connections.
+DOWNLOAD_LIMIT = trio.CapacityLimiter(32)
 
 
 async def download_mineos(
     client: httpx.AsyncClient,
     url: str,
     path: str,
+    root: pathlib.Path,
 ) -> None:
-    """Download contents of url and save to given path inside `mineos` folder."""
-    path = await trio.Path("mineos").joinpath(*path.split("/")).absolute()
-    async with MK_FILES_LOCK:
-        if not await path.parent.exists():
-            await path.parent.mkdir(parents=True)
-    response = await client.get(url, follow_redirects=True)
-    response.raise_for_status()
-    async with await path.open("wb") as file:
-        await file.write(await response.aread())
-    await response.aclose()
+    """Download contents of url and save to given path inside root folder.
+
+    root should be an absolute path.
+    """
+    async with DOWNLOAD_LIMIT:
+        target = trio.Path(root, *path.split("/"))
+        parent = target.parent
+        if parent not in CREATED_DIRECTORIES:
+            await parent.mkdir(parents=True, exist_ok=True)
+            CREATED_DIRECTORIES.add(parent)
+        async with client.stream(
+            "GET",
+            url,
+            follow_redirects=True,
+        ) as response:
+            response.raise_for_status()
+            async with await target.open("wb") as file:
+                # Each write is a worker thread hop, so collect chunks and
+                # write them in larger batches.
+                buffer = bytearray()
+                async for chunk in response.aiter_bytes(65536):
+                    buffer += chunk
+                    if len(buffer) >= WRITE_BUFFER_SIZE:
+                        await file.write(buffer)
+                        buffer.clear()
+                # Whole body has been read, so hand the connection back
+                # to the pool now instead of after the last write.
+                await response.aclose()
+                if buffer:
+                    await file.write(buffer)
 
 
 async def download_publication(
     client: httpx.AsyncClient,
     publication: Publication,
+    root: pathlib.Path,
 ) -> None:
-    """Download all files and dependencies from publication."""
+    """Download all files and dependencies from publication into root."""
     main_file_path = publication.publication_name
     if not main_file_path and publication.category_id in {1, 4}:
         main_file_path = "Main.lua"
 
-    await download_mineos(
-        client,
-        publication.source_url,
-        main_file_path + f"/{publication.path}",
-    )
+    main_path = main_file_path + f"/{publication.path}"
+
+    # Shared dependencies can show up more than once, so remember what
+    # (url, path) pairs are already being downloaded.
+    scheduled: set[tuple[str, str]] = {(publication.source_url, main_path)}
+
+    # Download main file at the same time as all of the dependencies
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(
+            download_mineos,
+            client,
+            publication.source_url,
+            main_path,
+            root,
+        )
 
-    if publication.dependencies:
-        async with trio.open_nursery() as nursery:
+        if publication.dependencies:
             for dependency_id in publication.all_dependencies:
                 dependency = publication.dependencies_data[dependency_id]
 
@@ -134,33 +189,37 @@ async def download_publication(
                     dependency,
                 )
 
+                key = (dependency.source_url, dependency_path)
+                if key in scheduled:
+                    continue
+                scheduled.add(key)
+
                 nursery.start_soon(
                     download_mineos,
                     client,
                     dependency.source_url,
                     dependency_path,
+                    root,
                 )
 
 
-async def async_run() -> None:
-    """Run async."""
-    path = await trio.Path("mineos").absolute()
-    consent = (
-        input(
-            f"Making sure, it is ok for us to download files to {path}? (y/N): ",
-        ).lower()
-        == "y"
-    )
-    if not consent:
-        print("Exiting.")
-        return
-
-    print("Good example file ID is `106`")
-    file_id = int(input("Input Publication ID to download: "))
-
+async def async_run(root: pathlib.Path, file_id: int) -> None:
+    """Run async, downloading publication file_id into absolute path root."""
     print("\nDownloading Publication Manifest...")
     # Create httpx client
-    async with httpx.AsyncClient(timeout=15) as client:  # http2 = True
+    # With HTTP/2, requests started while the first connection to a host
+    # is still being set up wait for it and then share it, instead of all
+    # doing their own TCP and TLS handshakes. This means there is no need
+    # to open warm connections before starting dependency downloads.
+    async with httpx.AsyncClient(
+        timeout=15,
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=64,
+            max_keepalive_connections=32,
+            keepalive_expiry=30,
+        ),
+    ) as client:
         # Retrieve publication
         publication = await get_publication(
             client,
@@ -170,13 +229,32 @@ async def async_run() -> None:
         print(
             "\nPublication Manifest download complete.\nDownloading files...",
         )
-        await download_publication(client, publication)
+        await download_publication(client, publication, root)
     print("\nPublication download complete.")
 
 
 def run() -> None:
     """Run example."""
-    trio.run(async_run, strict_exception_groups=True)
+    # Only reads the current directory, so resolve it once up front
+    # instead of in a worker thread for every file downloaded.
+    root = pathlib.Path("mineos").absolute()
+
+    # Ask questions before starting trio so input does not block the
+    # event loop.
+    consent = (
+        input(
+            f"Making sure, it is ok for us to download files to {root}? (y/N): ",
+        ).lower()
+        == "y"
+    )
+    if not consent:
+        print("Exiting.")
+        return
+
+    print("Good example file ID is `106`")
+    file_id = int(input("Input Publication ID to download: "))
+
+    trio.run(async_run, root, file_id, strict_exception_groups=True)
 
 
 if __name__ == "__main__":
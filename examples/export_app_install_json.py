@@ -27,11 +27,10 @@ __author__ = "CoolCat467"
 __version__ = "0.0.0"
 __license__ = "GNU General Public License Version 3"
 
-import json
 import os
-from typing import Any
 
 import httpx
+import orjson
 import trio
 
 from market_api import (
@@ -42,108 +41,125 @@ from market_api import (
 )
 
 
-def named_tuple_to_dict(tuple_: tuple[object, ...]) -> dict[str, object]:
-    """Convert named tuple to dictionary."""
-    if not hasattr(tuple_, "_asdict"):
-        raise ValueError("Must be NamedDict instance")
-    return tuple_._asdict()
+def named_tuple_to_dict(tuple_: object) -> dict[str, object]:
+    """Convert named tuple to dictionary.
+
+    Used as the JSON encoder `default` hook, so raises TypeError for
+    anything else.
+    """
+    fields = getattr(tuple_, "_fields", None)
+    if fields is None or not isinstance(tuple_, tuple):
+        raise TypeError(f"Must be NamedTuple instance, not {type(tuple_)}")
+    return dict(zip(fields, tuple_, strict=True))
 
 
 async def retrieve_details(
     client: httpx.AsyncClient,
     file_id: int,
     language_id: PUBLICATION_LANGUAGE = PUBLICATION_LANGUAGE.English,
+    max_in_flight: int = 32,
 ) -> dict[int, Publication]:
-    """Retrieve details of given file id and all dependencies of this publication."""
-    # Get publication data
-    publication = await get_publication(
-        client,
-        file_id=file_id,
-        language_id=language_id,
-    )
+    """Retrieve details of given file id and all dependencies of this publication.
 
+    Every publication in the dependency graph is requested exactly once,
+    with at most `max_in_flight` requests running at the same time.
+    """
     # Collecting all manifests
     files: dict[int, Publication] = {}
-    files[file_id] = publication
-
-    # Discover dependencies
-    deps = set()
-    if publication.dependencies:
-        deps |= set(publication.dependencies)
-    if publication.all_dependencies:
-        deps |= set(publication.dependencies)
-
-    async def retrieve_dep(dep_id: int) -> None:
-        """Handle retrieving one depencancy."""
-        try:
-            # Recursive download all required for this dependency
-            details = await retrieve_details(
-                client,
-                dep_id,
-                language_id,
-            )
-            # Add on to existing list
-            files.update(details)
-        except APIError:
-            # If dependency does not exist, should be given in
-            # publication's `dependencies_data` section.
-            files[dependency_id] = publication.dependencies_data[dependency_id]
-
-    # Start retrieving all dependencies at the same time
-    async with trio.open_nursery() as nursery:
-        for dependency_id in sorted(deps):
-            nursery.start_soon(retrieve_dep, dependency_id)
-
-    return files
+    seen: set[int] = set()
+    limiter = trio.CapacityLimiter(max_in_flight)
 
+    async with trio.open_nursery() as nursery:
 
-def manifest_to_dict(
-    manifest: dict[str, Publication],
-) -> dict[str, dict[str, object]]:
-    """Convert dict of named tuples to dict of dicts."""
-    new: dict[str, Any] = {}
-    for key, value in manifest.items():
-        new[key] = named_tuple_to_dict(value)
-    return new
+        async def retrieve(dep_id: int, parent: Publication | None) -> None:
+            """Retrieve one publication and schedule its dependencies."""
+            try:
+                async with limiter:
+                    publication = await get_publication(
+                        client,
+                        file_id=dep_id,
+                        language_id=language_id,
+                    )
+            except APIError:
+                if parent is None:
+                    raise
+                # If dependency does not exist, should be given in
+                # parent publication's `dependencies_data` section.
+                files[dep_id] = parent.dependencies_data[dep_id]
+                return
+            files[dep_id] = publication
+
+            # Start retrieving all new dependencies at the same time
+            for child_id in (
+                publication.all_dependencies or publication.dependencies or ()
+            ):
+                if child_id in seen:
+                    continue
+                seen.add(child_id)
+                nursery.start_soon(retrieve, child_id, publication)
+
+        seen.add(file_id)
+        nursery.start_soon(retrieve, file_id, None)
 
+    return files
 
-async def async_run() -> None:
-    """Run async."""
-    print("Good example file ID is `1936`")
-    file_id = int(input("Input File ID to save manifest of: "))
 
+async def async_run(file_id: int) -> None:
+    """Run async, saving manifest of file_id."""
     print("\nDownloading Manifest...")
     # Create httpx client
-    async with httpx.AsyncClient(timeout=15) as client:  # http2 = True
+    async with httpx.AsyncClient(
+        timeout=15,
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=64,
+            max_keepalive_connections=32,
+            keepalive_expiry=30,
+        ),
+    ) as client:
         # Retrieve manifests
-        all_manifests = await retrieve_details(
+        manifest = await retrieve_details(
             client,
             file_id=file_id,
             language_id=PUBLICATION_LANGUAGE.English,
         )
-        # Convert to dictionaries so JSON encoder is helpful
-        manifest = manifest_to_dict(all_manifests)
 
     print("\nManifest download complete.")
 
-    filename = input(f"\nSave file in {os.getcwd()!r} as given filename: ")
+    # Done downloading, but keep the event loop free while waiting on the
+    # user anyway.
+    filename = await trio.to_thread.run_sync(
+        input,
+        f"\nSave file in {os.getcwd()!r} as given filename: ",
+    )
 
     # Add .json if no extension given
     if "." not in filename:
         filename += ".json"
 
-    # Get absolute save path
-    path = await trio.Path(filename).absolute()
+    # Encode everything up front, publications and nested named tuples
+    # such as dependencies_data entries are converted by `default` as
+    # the encoder reaches them.
+    data = orjson.dumps(
+        manifest,
+        default=named_tuple_to_dict,
+        option=orjson.OPT_SORT_KEYS
+        | orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_INDENT_2,
+    )
 
     # Write JSON data to file
-    async with await path.open("w", encoding="utf-8") as file_handle:
-        await file_handle.write(json.dumps(manifest, sort_keys=True))
+    await trio.Path(filename).write_bytes(data)
     print(f"\nSaved manifest to {filename!r}.")
 
 
 def run() -> None:
     """Run example."""
-    trio.run(async_run, strict_exception_groups=True)
+    # Ask before starting trio so input does not block the event loop.
+    print("Good example file ID is `1936`")
+    file_id = int(input("Input File ID to save manifest of: "))
+
+    trio.run(async_run, file_id, strict_exception_groups=True)
 
 
 if __name__ == "__main__":
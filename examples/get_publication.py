@@ -10,7 +10,6 @@ __title__ = "Get Publication Example"
 __author__ = "CoolCat467"
 __license__ = "MIT"
 
-import httpx
 import trio
 
 from market_api import (
@@ -18,14 +17,16 @@ from market_api import (
     get_publication,
     get_reviews,
     get_statistics,
+    make_client,
     pretty_print_response,
 )
 
 
 async def async_run() -> None:
     """Run async."""
-    # Create httpx client
-    async with httpx.AsyncClient(timeout=15) as client:  # http2 = True
+    # Create httpx client, reused for every request below so they share
+    # pooled keep-alive connections
+    async with make_client() as client:
         file_id = 1936
         # Get publication number and print it out nicely
         pretty_print_response(
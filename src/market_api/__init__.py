@@ -28,17 +28,21 @@ __version__ = "0.0.0"
 __license__ = "GNU General Public License Version 3"
 
 
+import re
 import sys
+import time
+import weakref
 from enum import IntEnum
+from types import MappingProxyType
 from typing import TYPE_CHECKING, Any, Final, NamedTuple
 
-from market_api import lua_parser
-
 if TYPE_CHECKING:
-    from collections.abc import Iterable
+    from types import ModuleType
 
     import httpx
 
+    from market_api import lua_parser as lua_parser
+
 # HOST = "http://mineos.modder.pw/MineOSAPI/2.04/"
 HOST = "http://mineos.buttex.ru/MineOSAPI/2.04/"
 ##AGENT: Final = (
@@ -66,18 +70,43 @@ AGENT = "CoolCat Market Client"
 # register : name, email, password
 # publications : Optional: category_id, order_by, order_direction, offset, count, search, file_ids
 
-LICENSES: Final = {
-    1: "MIT",
-    2: "GNU GPLv3",
-    3: "GNU AGPLv3",
-    4: "GNU LGPLv3",
-    5: "Apache Licence 2.0",
-    6: "Mozilla Public License 2.0",
-    7: "The Unlicense",
-}
+LICENSES: Final = MappingProxyType(
+    {
+        1: "MIT",
+        2: "GNU GPLv3",
+        3: "GNU AGPLv3",
+        4: "GNU LGPLv3",
+        5: "Apache Licence 2.0",
+        6: "Mozilla Public License 2.0",
+        7: "The Unlicense",
+    },
+)
+# License name to license_id, for looking up ids to upload with
+LICENSE_IDS_BY_NAME: Final = MappingProxyType(
+    {name: license_id for license_id, name in LICENSES.items()},
+)
 
 ORDER_BY: Final = ("popularity", "rating", "name", "date")
 
+# Html page opening tag and title, searched for in the head of responses
+# that start with markup
+HTML_REGEX: Final = re.compile(
+    r"<html\b[^>]*>(?:.*?<title>(.*?)</title>)?",
+    re.IGNORECASE | re.DOTALL,
+)
+# How many characters at the start of a response to look for html in
+HTML_HEAD_SIZE: Final = 4096
+# Whole failure response with at most a plain reason string, so the error
+# path can raise without parsing the table. Anything else is parsed.
+FAILURE_REGEX: Final = re.compile(
+    r"\s*\{\s*(?:"
+    r'success\s*=\s*false\s*(?:[,;]\s*reason\s*=\s*"([^"\\]*)"\s*)?'
+    r'|reason\s*=\s*"([^"\\]*)"\s*[,;]\s*success\s*=\s*false\s*'
+    r")[,;]?\s*\}\s*",
+)
+# APIError message for failures that did not say why
+NO_REASON: Final = "<no reason returned by marketplace API>"
+
 
 class PublicationCategory(IntEnum):
     """Publication category enums."""
@@ -108,17 +137,63 @@ class FileType(IntEnum):
     PREVIEW = 5
 
 
+# Headers here may not be required but just in case we send the same
+# headers MineOS itself sends.
+HEADERS: Final = MappingProxyType(
+    {
+        "User-Agent": AGENT,
+        "Content-Type": "application/x-www-form-urlencoded",
+    },
+)
+
+
 def get_url(script: str) -> str:
     """Return URL of script."""
     return f"{HOST}{script}.php"
 
 
+def make_client() -> httpx.AsyncClient:
+    """Return new httpx client set up for talking to the market API.
+
+    Create one client and reuse it for every API call, so requests share
+    pooled keep-alive connections instead of connecting each time.
+    """
+    import httpx
+
+    return httpx.AsyncClient(
+        base_url=HOST,
+        headers=HEADERS,
+        limits=httpx.Limits(
+            max_keepalive_connections=20,
+            max_connections=50,
+            keepalive_expiry=85.0,
+        ),
+        timeout=httpx.Timeout(10.0, connect=5.0),
+    )
+
+
 class APIError(Exception):
     """Market API Error Exception."""
 
     __slots__ = ()
 
 
+def html_page_data(
+    text: str,
+    html: re.Match[str],
+    html_raise_exception: bool,
+) -> dict[str, object]:
+    """Return html page response data, see `api_request`.
+
+    Raises APIError instead if html_raise_exception is set.
+    """
+    # If flag set, return html page data instead of exception
+    if not html_raise_exception:
+        return {"html": text}
+    title = text if html[1] is None else html[1]
+    raise APIError(f'Got HTML page "{title}", not MineOS data')
+
+
 async def api_request(
     client: httpx.AsyncClient,
     script: str,
@@ -133,39 +208,68 @@ async def api_request(
     html data as {"html": <content>} instead of raising an APIError
     exception.
     """
-    # Headers here may not be required but just in case we send the same
-    # headers MineOS itself sends.
-    headers = {
-        "User-Agent": AGENT,
-        "Content-Type": "application/x-www-form-urlencoded",
-    }
-
-    # Send post request to script endpoint
-    response = await client.post(get_url(script), data=post, headers=headers)
-
-    text = response.text
-    # See if returned response might be an html page
-    if "<html>" in text:
-        # If flag set, return html page data instead of exception
-        if not html_raise_exception:
-            return {"html": text}
-        title = text
-        # Find title
-        if "<title>" in text and "</title>" in text:
-            start = text.index("<title>")
-            end = text.index("</title>")
-            title = text[start + 7 : end]
-        raise APIError(f'Got HTML page "{title}", not MineOS data')
-
-    # Parse
-    table = lua_parser.parse_lua_table(text)
+    # Send post request to script endpoint. The body is streamed and
+    # decoded once, so no raw bytes are held by the response while the
+    # text is being parsed.
+    async with client.stream(
+        "POST",
+        get_url(script),
+        data=post,
+        headers=HEADERS,
+    ) as response:
+        chunks = [chunk async for chunk in response.aiter_bytes()]
+    text = b"".join(chunks).decode(
+        response.encoding or "utf-8",
+        errors="replace",
+    )
+    del chunks
+    head = text[:HTML_HEAD_SIZE]
+    # See if returned response might be an html page. Lua tables never
+    # start with "<", so only look for html when the server did not say
+    # it sent something else and the body starts like markup.
+    content_type = response.headers.get("content-type", "text/html")
+    if (
+        "html" in content_type
+        and head.lstrip().startswith("<")
+        and (html := HTML_REGEX.search(head))
+    ):
+        return html_page_data(text, html, html_raise_exception)
+
+    # Failures are small and common when rate limited, raise straight away
+    if failure := FAILURE_REGEX.fullmatch(text):
+        reason = failure[2] if failure[1] is None else failure[1]
+        raise APIError(NO_REASON if reason is None else reason)
+
+    table: object = None
+    # MineOS sends Lua tables, but if the server says a body is JSON and
+    # orjson is installed, decode it with that C parser instead
+    if "json" in content_type:
+        try:
+            import orjson
+        except ImportError:  # pragma: no cover
+            pass
+        else:
+            try:
+                table = orjson.loads(text)
+            except orjson.JSONDecodeError:
+                table = None
+    if table is None:
+        # Parse. Imported here so only callers that make requests pay for
+        # compiling the parser's regular expressions.
+        from market_api import lua_parser
+
+        try:
+            table = lua_parser.parse_lua_table(text)
+        except lua_parser.ParseError:
+            # Html error pages can start with text, or be sent with some
+            # other content type, so look for one before giving up
+            if (html := HTML_REGEX.search(head)) is None:
+                raise
+            return html_page_data(text, html, html_raise_exception)
     assert isinstance(table, dict)
 
     if not table.get("success", True):
-        table["reason"] = table.get(
-            "reason",
-            "<no reason returned by marketplace API>",
-        )
+        table["reason"] = table.get("reason", NO_REASON)
         raise APIError(table["reason"])
     return table
 
@@ -230,9 +334,9 @@ async def login(
     request = {"password": password}
 
     if name is not None:
-        request.update({"name": name})
+        request["name"] = name
     if email is not None:
-        request.update({"email": email})
+        request["email"] = email
 
     response = await api_request(
         client,
@@ -260,6 +364,22 @@ class SearchPublication(NamedTuple):
     popularity: float | None = None
 
 
+# Recent get_publications results by request arguments, mapped to the
+# time.monotonic() time they were fetched and the results, oldest first
+SEARCH_CACHE: Final[
+    dict[tuple[object, ...], tuple[float, list[SearchPublication]]]
+] = {}
+# Seconds cached search results are used for before searching again
+SEARCH_CACHE_TTL: Final = 15.0
+# Most searches to keep in SEARCH_CACHE, oldest quarter is dropped when full
+SEARCH_CACHE_SIZE: Final = 256
+
+
+def clear_search_cache() -> None:
+    """Forget cached `get_publications` results."""
+    SEARCH_CACHE.clear()
+
+
 async def get_publications(
     client: httpx.AsyncClient,
     category_id: PublicationCategory | None = None,
@@ -287,21 +407,40 @@ async def get_publications(
     File IDs allow you to get back specific publications
     Note that these values are not the full results you can get from
     `get_publication`.
+
+    Results, including empty ones, are remembered for SEARCH_CACHE_TTL
+    seconds, see `clear_search_cache` to search again sooner.
     """
+    key = (
+        category_id,
+        order_by,
+        order_direction,
+        offset,
+        count,
+        search,
+        None if file_ids is None else tuple(file_ids),
+    )
+    cached = SEARCH_CACHE.get(key)
+    if cached is not None:
+        fetched, publications = cached
+        if time.monotonic() - fetched < SEARCH_CACHE_TTL:
+            return list(publications)
+        del SEARCH_CACHE[key]
+
     request: dict[str, str | int | list[int]] = {"count": count}
 
     if category_id is not None:
-        request.update({"category_id": category_id})
+        request["category_id"] = category_id
     if order_by is not None:
-        request.update({"order_by": order_by})
+        request["order_by"] = order_by
     if order_direction is not None:
-        request.update({"order_direction": order_direction})
+        request["order_direction"] = order_direction
     if offset is not None:
-        request.update({"offset": offset})
+        request["offset"] = offset
     if search is not None:
-        request.update({"search": search})
+        request["search"] = search
     if file_ids is not None:
-        request.update({"file_ids": file_ids})
+        request["file_ids"] = file_ids
 
     response = await api_request(
         client,
@@ -310,36 +449,123 @@ async def get_publications(
     )
     results = response["result"]
     assert isinstance(results, list)
-    return [SearchPublication(**obj) for obj in results]
+    publications = [SearchPublication(**obj) for obj in results]
+
+    # Drop the oldest quarter when full, dictionaries keep insertion order
+    if len(SEARCH_CACHE) >= SEARCH_CACHE_SIZE:
+        for old_key in list(SEARCH_CACHE)[: SEARCH_CACHE_SIZE // 4]:
+            del SEARCH_CACHE[old_key]
+    SEARCH_CACHE[key] = (time.monotonic(), publications)
+    return list(publications)
+
+
+# Count asked for once per client to find out how many publications the
+# server really returns per request
+MAX_COUNT_PROBE: Final = 1000
+# Largest count each client's server has been seen to honour
+MAX_COUNT_CACHE: Final[weakref.WeakKeyDictionary[httpx.AsyncClient, int]] = (
+    weakref.WeakKeyDictionary()
+)
 
 
 async def get_all_publications(
     client: httpx.AsyncClient,
     category_id: PublicationCategory,
-    per_request: int = 100,
+    per_request: int | None = None,
+    batch_size: int = 8,
 ) -> dict[int, SearchPublication]:
     """Return a dictionary mapping publication ids to publication objects.
 
-    For `per_request`, see `get_publications`'s `count` argument.
+    For `per_request`, see `get_publications`'s `count` argument. If not
+    given, the first call for a client asks for `MAX_COUNT_PROBE` and
+    pages by however many the server returned from then on. If fewer
+    come back, the next page is fetched as well before remembering
+    that count, as a category that fit in one page looks the same.
+
+    `batch_size` pages are requested at the same time, so the whole
+    category takes far fewer round trips than fetching page by page.
 
     Returns all results in the entire marketplace for a given category.
+
+    Raises ValueError if `per_request` or `batch_size` is not positive.
     """
+    if per_request is not None and per_request < 1:
+        raise ValueError(f"per_request must be positive, got {per_request}")
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be positive, got {batch_size}")
+
+    # Imported here so importing market_api does not have to load anyio
+    import anyio
+
     all_items: dict[int, SearchPublication] = {}
-    page = 0
-    while True:
-        publications = await get_publications(
+    # Fetched pages not merged into all_items yet, by page number
+    pages: dict[int, list[SearchPublication]] = {}
+
+    async def fetch_page(page: int, count: int) -> None:
+        """Fetch one page of count publications into pages."""
+        pages[page] = await get_publications(
             client,
             category_id=category_id,
-            offset=page * per_request,
-            count=per_request,
+            offset=page * count,
+            count=count,
         )
 
-        if not publications:
-            break
+    # Errors raised by pages of the current batch, by page number
+    failures: dict[int, Exception] = {}
+
+    async def fetch_batch_page(page: int, count: int) -> None:
+        """Fetch page like `fetch_page`, saving its error in failures."""
+        try:
+            await fetch_page(page, count)
+        except Exception as exc:
+            failures[page] = exc
+
+    def merge_page(page: int, count: int) -> bool:
+        """Merge fetched page into all_items, return if it was the last."""
+        publications = pages.pop(page)
         for publication in publications:
             all_items[publication.file_id] = publication
+        # A page that is not full is the last one
+        return len(publications) < count
+
+    page = 0
+    if per_request is None:
+        per_request = MAX_COUNT_CACHE.get(client)
+    if per_request is None:
+        await fetch_page(page, MAX_COUNT_PROBE)
+        per_request = len(pages[page])
+        merge_page(page, per_request)
+        if not per_request:
+            return all_items
         page += 1
-    return all_items
+        if per_request < MAX_COUNT_PROBE:
+            # Either the server capped the count or the whole category
+            # fit in one page, only the next page can tell which.
+            await fetch_page(page, per_request)
+            if not pages[page]:
+                return all_items
+        # A full probe or a second page shows the server gives this many
+        MAX_COUNT_CACHE[client] = per_request
+
+    while True:
+        # Merge fetched pages in order, including one the probe fetched.
+        # A page that is not full is the last one, so there is no need
+        # to request another batch to find the end.
+        while page in pages:
+            if merge_page(page, per_request):
+                return all_items
+            page += 1
+        async with anyio.create_task_group() as task_group:
+            for batch_page in range(page, page + batch_size):
+                task_group.start_soon(
+                    fetch_batch_page,
+                    batch_page,
+                    per_request,
+                )
+        # Raise the first page's error itself rather than an exception
+        # group, the same as when the probe fails
+        if failures:
+            raise failures[min(failures)]
 
 
 class Dependency(NamedTuple):
@@ -381,12 +607,61 @@ class Publication(NamedTuple):
     downloads: int = 0
 
 
+# Recently fetched publications by (file_id, language_id), mapped to the
+# time.monotonic() time they were fetched and the publication, oldest first
+PUBLICATION_CACHE: Final[dict[tuple[int, int], tuple[float, Publication]]] = {}
+# Seconds a cached publication is used for before fetching it again
+PUBLICATION_CACHE_TTL: Final = 60.0
+# Most publications to keep in PUBLICATION_CACHE
+PUBLICATION_CACHE_SIZE: Final = 512
+
+
+def clear_publication_cache(file_id: int | None = None) -> None:
+    """Forget cached `get_publication` results.
+
+    If file_id is given, only forget that publication.
+    """
+    if file_id is None:
+        PUBLICATION_CACHE.clear()
+        return
+    for key in [key for key in PUBLICATION_CACHE if key[0] == file_id]:
+        del PUBLICATION_CACHE[key]
+
+
+def copy_publication(publication: Publication) -> Publication:
+    """Return copy of publication that does not share its mutable fields.
+
+    Keeps changes callers make to a result out of PUBLICATION_CACHE.
+    """
+    dependencies = publication.dependencies
+    all_dependencies = publication.all_dependencies
+    return publication._replace(
+        dependencies_data=dict(publication.dependencies_data),
+        dependencies=None if dependencies is None else list(dependencies),
+        all_dependencies=(
+            None if all_dependencies is None else list(all_dependencies)
+        ),
+    )
+
+
 async def get_publication(
     client: httpx.AsyncClient,
     file_id: int,
     language_id: int,
 ) -> Publication:
-    """Return Publication object associated with given file id."""
+    """Return Publication object associated with given file id.
+
+    Results are remembered for PUBLICATION_CACHE_TTL seconds, see
+    `clear_publication_cache` to fetch them again sooner.
+    """
+    key = (file_id, language_id)
+    cached = PUBLICATION_CACHE.get(key)
+    if cached is not None:
+        fetched, publication = cached
+        if time.monotonic() - fetched < PUBLICATION_CACHE_TTL:
+            return copy_publication(publication)
+        del PUBLICATION_CACHE[key]
+
     response = await api_request(
         client,
         "publication",
@@ -394,22 +669,25 @@ async def get_publication(
     )
     result = response["result"]
     assert isinstance(result, dict)
+    dependencies = result.get("dependencies_data") or {}
+    if isinstance(dependencies, list):
+        # Ids counting up from 1 come back from the parser as a list
+        dependencies = dict(enumerate(dependencies, 1))
     try:
-        result.update(
-            {
-                "dependencies_data": {
-                    k: Dependency(**v)
-                    for k, v in dict(
-                        result.get("dependencies_data", {}),
-                    ).items()
-                },
-            },
-        )
+        result["dependencies_data"] = {
+            int(k): Dependency(**v) for k, v in dependencies.items()
+        }
     except Exception as ex:
         if sys.version_info >= (3, 11):
             ex.add_note(f"publication {file_id = }")
         raise
-    return Publication(**result)
+    publication = Publication(**result)
+
+    # Evict the oldest entry when full, dictionaries keep insertion order
+    if len(PUBLICATION_CACHE) >= PUBLICATION_CACHE_SIZE:
+        del PUBLICATION_CACHE[next(iter(PUBLICATION_CACHE))]
+    PUBLICATION_CACHE[key] = (time.monotonic(), publication)
+    return copy_publication(publication)
 
 
 async def update_publication(
@@ -448,13 +726,16 @@ async def update_publication(
     }
 
     if whats_new is not None:
-        request.update({"whats_new": whats_new})
+        request["whats_new"] = whats_new
 
-    return await api_request(
+    response = await api_request(
         client,
         "update",
         request,
     )
+    clear_publication_cache(file_id)
+    clear_search_cache()
+    return response
 
 
 async def upload_publication(
@@ -491,13 +772,15 @@ async def upload_publication(
     }
 
     if whats_new is not None:
-        request.update({"whats_new": whats_new})
+        request["whats_new"] = whats_new
 
-    return await api_request(
+    response = await api_request(
         client,
         "upload",
         request,
     )
+    clear_search_cache()
+    return response
 
 
 async def delete_publication(
@@ -506,11 +789,14 @@ async def delete_publication(
     file_id: int,
 ) -> dict[str, object]:
     """Delete a publication that account associated with token owns."""
-    return await api_request(
+    response = await api_request(
         client,
         "delete",
         {"token": token, "file_id": file_id},
     )
+    clear_publication_cache(file_id)
+    clear_search_cache()
+    return response
 
 
 class Notification(NamedTuple):
@@ -707,65 +993,60 @@ async def mark_downloaded(
     return value
 
 
-def indent(level: int, text: str) -> str:
-    """Indent text by level of spaces."""
-    prefix = " " * level
-    return "\n".join(prefix + line for line in text.splitlines())
-
-
 def pretty_format_response(
     response: dict[str, Any] | list[Any] | set[Any] | tuple[Any, ...],
 ) -> str:
     """Pretty format response data."""
-
-    def print_named_tuple(
-        result: Iterable[object],
-        field_names: tuple[str, ...],
-    ) -> str:
-        fields = []
-        for field, obj in zip(field_names, result, strict=False):
-            fields.append(f"{field} = {print_value(obj)}")
-        value = ",\n".join(fields)
-        return f"(\n{indent(2, value)}\n)"
-
-    def print_iterable(result: Iterable[Any], end: str = "[]") -> str:
-        if not result:
-            return end
-        value = ",\n".join(map(print_value, result))
-        return f"{end[0]}\n{indent(2, value)}\n{end[1]}"
-
-    def print_tuple(result: tuple[Any, ...]) -> str:
-        if hasattr(result, "_fields"):
-            return print_named_tuple(result, result._fields)
-        return print_iterable(result, "()")
-
-    def print_set(result: set[Any]) -> str:
-        if not result:
-            return "set()"
-        return print_iterable(result, "{}")
-
-    def print_dict(result: dict[object, object]) -> str:
-        if not result:
-            return "{}"
-        formatted = {print_value(k): print_value(v) for k, v in result.items()}
-        value = ",\n".join(f"{k}: {v}" for k, v in formatted.items())
-        return f"{{\n{indent(2, value)}\n}}"
-
-    def print_value(result: object) -> str:
-        if isinstance(result, tuple):
-            return print_tuple(result)
-        if isinstance(result, list):
-            return print_iterable(result)
-        if isinstance(result, set):
-            return print_set(result)
-        if isinstance(result, dict):
-            return print_dict(result)
-        if isinstance(result, str | int | float | None):
-            return repr(result)
-        # raise NotImplementedError(type(result))
-        return repr(result)
-
-    return print_value(response)
+    out: list[str] = []
+    write = out.append
+    # Items are either text to write as-is or (level, value) to format,
+    # popped in reverse so pushed parts come out in order
+    stack: list[str | tuple[int, object]] = [(0, response)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            write(item)
+            continue
+        level, value = item
+        inner = level + 2
+        newline = "\n" + " " * inner
+        parts: list[str | tuple[int, object]] = []
+        fields = getattr(value, "_fields", None)
+        if isinstance(value, tuple) and fields is not None:
+            write("(")
+            for field, obj in zip(fields, value, strict=False):
+                parts.extend((newline, f"{field} = ", (inner, obj), ","))
+            close = ")"
+        elif isinstance(value, tuple | list | set):
+            if not value:
+                write("set()" if isinstance(value, set) else repr(value))
+                continue
+            start, close = (
+                "()"
+                if isinstance(value, tuple)
+                else "[]" if isinstance(value, list) else "{}"
+            )
+            write(start)
+            for obj in value:
+                parts.extend((newline, (inner, obj), ","))
+        elif isinstance(value, dict):
+            if not value:
+                write("{}")
+                continue
+            write("{")
+            for key, obj in value.items():
+                parts.extend((newline, (inner, key), ": ", (inner, obj), ","))
+            close = "}"
+        else:
+            write(repr(value).replace("\n", "\n" + " " * level))
+            continue
+        # Last element does not get a trailing comma
+        if parts:
+            parts[-1] = "\n" + " " * level + close
+        else:
+            parts.append(("\n" + " " * level) * 2 + close)
+        stack.extend(reversed(parts))
+    return "".join(out)
 
 
 def pretty_print_response(
@@ -775,5 +1056,16 @@ def pretty_print_response(
     print(pretty_format_response(response))
 
 
+if not TYPE_CHECKING:
+
+    def __getattr__(name: str) -> ModuleType:
+        """Import lua_parser on first access, it is not loaded up front."""
+        if name == "lua_parser":
+            import importlib
+
+            return importlib.import_module(f"{__name__}.{name}")
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == "__main__":
     print(f"{__title__} v{__version__}\nProgrammed by {__author__}.\n")
@@ -25,20 +25,22 @@ __author__ = "CoolCat467"
 __license__ = "GNU General Public License Version 3"
 
 
+import copy
+import functools
 import re
-from collections import deque
+import sys
 from typing import (
     TYPE_CHECKING,
     Any,
+    Final,
     Generic,
     NamedTuple,
     NoReturn,
     TypeVar,
-    cast,
 )
 
 if TYPE_CHECKING:
-    from collections.abc import Collection
+    from collections.abc import Callable, Collection, Iterable, Iterator
 
 
 class ParseError(Exception):
@@ -77,6 +79,12 @@ class Identifier(Token):
     __slots__ = ()
 
 
+class Keyword(Token):
+    """A reserved lua word, such as nil or true."""
+
+    __slots__ = ()
+
+
 class Operator(Token):
     """Base class for all operator tokens."""
 
@@ -125,102 +133,163 @@ class End(Token):
     __slots__ = ()
 
 
-KEYWORDS = {
-    "and",
-    "break",
-    "do",
-    "else",
-    "elseif",
-    "end",
-    "false",
-    "for",
-    "function",
-    "goto",
-    "if",
-    "in",
-    "local",
-    "nil",
-    "not",
-    "or",
-    "repeat",
-    "return",
-    "then",
-    "true",
-    "until",
-    "while",
+KEYWORDS = frozenset(
+    {
+        "and",
+        "break",
+        "do",
+        "else",
+        "elseif",
+        "end",
+        "false",
+        "for",
+        "function",
+        "goto",
+        "if",
+        "in",
+        "local",
+        "nil",
+        "not",
+        "or",
+        "repeat",
+        "return",
+        "then",
+        "true",
+        "until",
+        "while",
+    },
+)
+# Keywords that are values, and the python object each one stands for
+KEYWORD_VALUES: Final = {"true": True, "false": False, "nil": None}
+
+
+ESCAPE_SEQUENCES: Final = {
+    "a": "\a",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+    "v": "\v",
+    "\\": "\\",
 }
-
-IDENTIFIER = re.compile(r"^[a-z_][a-z_\d]*", re.IGNORECASE)
-COMMENT = re.compile("--.*\n")
-##INTEGER = re.compile('^[\d]+')
-NUMERIC = re.compile(r"^-?(\d+)(\.\d+)?(e(?:-|\+)?\d+)?")
-HEXADECIMAL = re.compile(
-    r"(0x[a-f\d]+)(\.[a-f\d]+)?(p(?:-|\+)?\d+)?",
-    re.IGNORECASE,
+# Decimal (\ddd) and hexadecimal (\xHH) escapes, or any single character
+ESCAPE_REGEX = re.compile(r"\\([0-9]{1,3}|x[a-fA-F0-9]{2}|.)", re.DOTALL)
+
+
+def decode_escape(match_: re.Match[str]) -> str:
+    """Return the character an ESCAPE_REGEX match stands for."""
+    escape = match_[1]
+    if escape[0].isdigit():
+        return chr(int(escape))
+    if len(escape) == 3:
+        return chr(int(escape[1:], 16))
+    # Unknown escapes become the escaped character itself
+    return ESCAPE_SEQUENCES.get(escape, escape)
+
+
+def numeric_value(text: str) -> int | float:
+    """Return the number numeric literal text stands for.
+
+    Raises ValueError if text is not a valid number.
+    """
+    # Tokenizer already checked the format matches TOKEN_REGEX's NUMBER
+    # group, so just look for the parts that make it a float
+    # instead of running the regular expressions again.
+    if text[:2] in {"0x", "0X"}:  # is hex?
+        if "." in text or "p" in text or "P" in text:
+            return float.fromhex(text)
+        return int(text, 16)
+    if "." in text or "e" in text or "E" in text:
+        return float(text)
+    return int(text)
+
+
+def decode_string_literal(text: str) -> str:
+    """Return value of string literal token text, without quotes."""
+    value = text[1:-1]
+    # Most strings have no escapes at all, skip the regex for them
+    if "\\" not in value:
+        return value
+    # Replace escape sequences like \a, \n, \097, \x61, etc.
+    return ESCAPE_REGEX.sub(decode_escape, value)
+
+
+# One alternation matching every token kind, tried in order.
+# `MISMATCH` catches anything no other group can start with.
+TOKEN_REGEX = re.compile(
+    r"""
+    (?P<WS>[ \r\t]+)
+    |(?P<NL>\n)
+    |(?P<COMMENT>--[^\n]*)
+    # Strings consume whole runs of plain characters at a time and only
+    # step through escapes, instead of one alternation per character.
+    |(?P<STRING>"[^"\\]*(?:\\.[^"\\]*)*"|'[^'\\]*(?:\\.[^'\\]*)*')
+    # Hexadecimal first, or the decimal branch would stop at its 0
+    |(?P<NUMBER>0[xX][a-fA-F\d]+(?:\.[a-fA-F\d]+)?(?:[pP][-+]?\d+)?
+      |-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)
+    |(?P<IDENT>[A-Za-z_][A-Za-z_\d]*)
+    |(?P<SEP>[()\[\]{},;])
+    |(?P<ASSIGN>=)
+    |(?P<MISMATCH>.)
+    """,
+    re.VERBOSE | re.DOTALL,
 )
 
+# Tokens that may follow a table field and a function call argument
+FIELD_SEPARATORS: Final = frozenset({",", ";", "}"})
+ARGUMENT_SEPARATORS: Final = frozenset({",", ")"})
+
+TOKEN_TYPES: dict[str, type[Token]] = {
+    "COMMENT": Comment,
+    "STRING": StrLit,
+    "NUMBER": Numeric,
+    "IDENT": Identifier,
+    "SEP": Separator,
+    "ASSIGN": Assignment,
+}
 
-def tokenize(text: str) -> list[Token]:
-    """Tokenize lua code."""
-    line = 1
-    column = -1
 
-    tokens: list[Token] = []
-    while True:
-        read = 1
-        last_line = line
-        token: type[Token] | None = End
-
-        if not text:
-            read = 0
-        elif text[0] in {" ", "\r", "\t"}:
-            token = None
-        elif text[0] == "\n":
-            token = None
+def tokenize_iter(text: str) -> Iterator[Token]:
+    """Yield tokens from lua code as they are read, ending with End."""
+    line = 1
+    # Offset in text where current line starts
+    line_start = 0
+
+    for match_ in TOKEN_REGEX.finditer(text):
+        kind = match_.lastgroup
+        if kind == "WS":
+            continue
+        start = match_.start()
+        if kind == "NL":
             line += 1
-        elif text[0] in "()[]{},;":
-            token = Separator
-        elif text.startswith("--"):
-            match_ = COMMENT.match(text)
-            if not match_:
-                raise ParseError(f"Could not parse comment from {text!r}")
-
-            token = Comment
-            read = match_.end() - 1
-        elif text[0] == "=":
-            token = Assignment
-        elif text[0] in {'"', "'"}:
-            read = 1
-            start_bracket = text[0]
-            while read < len(text):
-                char = text[read]
-                if char == start_bracket and text[read - 1] != "\\":
-                    read += 1
-                    break
-                read += 1
-
-            token = StrLit
-        else:
-            if match_ := (HEXADECIMAL.match(text) or NUMERIC.match(text)):
-                token = Numeric
-                read = match_.end()
-            elif match_ := IDENTIFIER.match(text):
-                token = Identifier
-                read = match_.end()
-            else:
-                print(f"{tokens = }")
-                raise ParseError(f"Could not parse {text!r}")
+            line_start = start + 1
+            continue
+        if kind == "MISMATCH":
+            raise ParseError(f"Could not parse {text[start:]!r}")
+
+        assert kind is not None
+        value = match_.group()
+        token_type = TOKEN_TYPES[kind]
+        if token_type is Identifier:
+            # Names repeat for every entry of a table, intern them so
+            # each one is stored once and compares by identity
+            value = sys.intern(value)
+            if value in KEYWORDS:
+                token_type = Keyword
+        yield token_type(value, line, start - line_start)
+
+        # String literals are the only tokens that can contain newlines
+        if kind == "STRING" and "\n" in value:
+            line += value.count("\n")
+            line_start = start + value.rindex("\n") + 1
+
+    yield End("", line, len(text) - line_start)
 
-        if last_line != line:
-            column = -1
-        else:
-            column += read
 
-        if token is not None:
-            tokens.append(token(text[:read], line, column))
-            if issubclass(token, End):
-                return tokens
-        text = text[read:]
+def tokenize(text: str) -> list[Token]:
+    """Tokenize lua code."""
+    return list(tokenize_iter(text))
 
 
 T = TypeVar("T")
@@ -234,14 +303,11 @@ class Value(Generic[T]):
     def __init__(
         self,
         name: str,
-        *args: T,
+        args: tuple[T, ...] = (),
     ) -> None:
-        """Set up name and arguments."""
+        """Set up name and arguments tuple."""
         self.name = name
-        if args:
-            self.args = tuple(args)
-        else:
-            self.args = ()
+        self.args = args
 
     def __repr__(self) -> str:
         """Return representation of self."""
@@ -252,20 +318,23 @@ class Value(Generic[T]):
         """Return type value representation of self."""
         if not self.args:
             return self.name or "[]"
-        args = []
-        for arg in self.args:
-            if isinstance(arg, Value):
-                args.append(str(arg))
-            else:
-                args.append(repr(arg))
-        values = ", ".join(args)
+        values = ", ".join(
+            [
+                str(arg) if isinstance(arg, Value) else repr(arg)
+                for arg in self.args
+            ],
+        )
         return f"{self.name}[{values}]"
 
     def __eq__(self, rhs: object) -> bool:
         """Return if rhs is equal to self."""
-        if isinstance(rhs, self.__class__):
+        if isinstance(rhs, Value):
             return self.name == rhs.name and self.args == rhs.args
-        return super().__eq__(rhs)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        """Return hash of name and arguments."""
+        return hash((self.name, self.args))
 
     def unpack(self) -> tuple[T | tuple[object, ...], ...]:
         """Unpack all arguments."""
@@ -304,13 +373,17 @@ def list_or(values: Collection[str]) -> str:
 class Parser:
     """Implementation of the lua parser."""
 
-    __slots__ = ("i", "next_indexed_field", "tokens")
+    __slots__ = ("last", "lookahead", "next_indexed_field", "tokens")
 
-    def __init__(self, tokens: list[Token]) -> None:
-        """Initialize with tokens list."""
-        self.tokens = tokens
-        self.i = 0
-        self.next_indexed_field: deque[int] = deque()
+    def __init__(self, tokens: Iterable[Token]) -> None:
+        """Initialize with tokens, read lazily as parsing needs them."""
+        self.tokens = iter(tokens)
+        # Tokens read from `tokens` but not processed yet, next one last
+        self.lookahead: list[Token] = []
+        # Last processed token, so `back` can return it to lookahead
+        self.last: Token | None = None
+        # Stack of next positional index for each table being parsed
+        self.next_indexed_field: list[int] = []
 
     def fail(self, error: str | None) -> NoReturn:
         """Raise parse error."""
@@ -318,9 +391,13 @@ class Parser:
 
     def peek(self) -> Token:
         """Peek at next token."""
-        if self.i >= len(self.tokens):
+        if self.lookahead:
+            return self.lookahead[-1]
+        token = next(self.tokens, None)
+        if token is None:
             self.fail("Ran out of tokens")
-        return self.tokens[self.i]
+        self.lookahead.append(token)
+        return token
 
     def lookup(self) -> str:
         """Peek at next token and return it's text."""
@@ -330,17 +407,31 @@ class Parser:
 
     def next(self) -> Token:
         """Get next token."""
-        token = self.peek()
-        self.i += 1
+        # Take straight from the token iterator unless something was
+        # peeked or put back, instead of going through lookahead
+        token: Token | None
+        if self.lookahead:
+            token = self.lookahead.pop()
+        else:
+            token = next(self.tokens, None)
+            if token is None:
+                self.fail("Ran out of tokens")
+        self.last = token
         return token
 
     def back(self) -> None:
         """Go back one token."""
-        self.i -= 1
+        if self.last is None:
+            self.fail("Cannot go back more than one token")
+        self.lookahead.append(self.last)
+        self.last = None
 
     def rest_tokens(self) -> list[Token]:
         """Return all tokens not processed."""
-        return self.tokens[self.i : len(self.tokens)]
+        # Read everything that is left, but keep it for parsing later
+        rest = [*reversed(self.lookahead), *self.tokens]
+        self.lookahead = rest[::-1]
+        return rest
 
     def __repr__(self) -> str:
         """Return representation of self."""
@@ -380,56 +471,37 @@ class Parser:
             )
         return token
 
+    def expect_end(self) -> None:
+        """Expect no more tokens except comments before the end."""
+        token = self.next()
+        while isinstance(token, Comment):
+            token = self.next()
+        if not isinstance(token, End):
+            self.fail(
+                f"Expected end, got {token.text!r} ({token.location()})",
+            )
+
     def parse_string_literal(self) -> Value[str]:
         """Parse a string literal."""
         token = self.expect_type(StrLit)
-        # Read the string literal character by character and look for
-        # escape sequences like \a, \n, \t, etc.
-        value = ""
-        skip = 0  # Number of chars to not add to running value
-        for idx, char in enumerate(token.text):
-            if skip:
-                skip -= 1
-                continue
-            if char != "\\":
-                value += char
-                continue
-            # Is escape sequence start, so read next char to find which one
-            value += token.text[idx + 1].translate(
-                {
-                    97: "\a",
-                    98: "\b",
-                    102: "\f",
-                    110: "\n",
-                    114: "\r",
-                    116: "\t",
-                    118: "\v",
-                    92: "\\",
-                },
-            )
-            skip = 1
-        return Value("String", value[1:-1])
+        return Value("String", (decode_string_literal(token.text),))
 
     def parse_numeric_literal(self) -> Value[int | float]:
         """Parse a numeric literal."""
-        token = self.expect_type(Numeric)
-
-        text = token.text
-        match_ = HEXADECIMAL.match(text) or NUMERIC.match(text)
-        if match_ is None:
+        value = self.read_numeric(self.expect_type(Numeric))
+        return Value(
+            "Float" if isinstance(value, float) else "Integer",
+            (value,),
+        )
+
+    def read_numeric(self, token: Token) -> int | float:
+        """Return the number a numeric token stands for."""
+        try:
+            return numeric_value(token.text)
+        except ValueError:
             self.fail(
-                "Numeric literal regular expression did not match ({token.location()})",
+                f"Invalid numeric literal {token.text!r} ({token.location()})",
             )
-        decimal, fractional, exponent = match_.groups()
-
-        is_float = fractional or exponent
-
-        value: int | float
-        if decimal.lower().startswith("0x"):  # is hex?
-            value = float.fromhex(text) if is_float else int(text, 16)
-            return Value("Float" if is_float else "Integer", value)
-        value = float(text) if is_float else int(text)
-        return Value("Float" if is_float else "Integer", value)
 
     def parse_field(self) -> Value[Any]:
         """Parse table field."""
@@ -438,43 +510,56 @@ class Parser:
             value = self.parse_value()
             self.expect("]")
             self.expect_type(Assignment)
-            return Value("Field", value, self.parse_value())
+            return Value("Field", (value, self.parse_value()))
         peek = self.peek()
         if isinstance(peek, Identifier):
             return self.parse_identifier()
         if isinstance(peek, Comment):
             return self.parse_comment()
-        index = self.next_indexed_field.pop()
-        self.next_indexed_field.append(index + 1)
+        index = self.next_indexed_field[-1]
+        self.next_indexed_field[-1] = index + 1
         # return Value("Indexed", self.parse_value())
-        return Value("Field", Value("Integer", index), self.parse_value())
+        return Value(
+            "Field",
+            (Value("Integer", (index,)), self.parse_value()),
+        )
 
     def parse_table(self) -> Value[Value[Any]]:
         """Parse table."""
         self.expect("{")
         self.next_indexed_field.append(1)
         fields: list[Value[object | Value[object]]] = []
-        while self.lookup() != "}":
-            field = self.parse_field()
+        # Bind methods used for every field to locals
+        lookup = self.lookup
+        parse_field = self.parse_field
+        expect_or = self.expect_or
+        back = self.back
+        while lookup() != "}":
+            field = parse_field()
             fields.append(field)
             if field.name == "Comment":
                 continue
 
-            if self.expect_or({",", ";", "}"}).text == "}":
-                self.back()
+            if expect_or(FIELD_SEPARATORS).text == "}":
+                back()
         self.next_indexed_field.pop()
         self.expect("}")
-        return Value("Table", *fields)
+        return Value("Table", tuple(fields))
 
     def parse_function_arguments(self) -> list[Value[Any]]:
         """Parse function call arguments."""
         self.expect("(")
         arguments = []
-        while self.lookup() != ")":
-            arguments.append(self.parse_value())
-
-            if self.expect_or({",", ")"}).text == ")":
-                self.back()
+        # Bind methods used for every argument to locals
+        lookup = self.lookup
+        parse_value = self.parse_value
+        expect_or = self.expect_or
+        back = self.back
+        while lookup() != ")":
+            arguments.append(parse_value())
+
+            if expect_or(ARGUMENT_SEPARATORS).text == ")":
+                back()
         self.expect(")")
         return arguments
 
@@ -482,158 +567,274 @@ class Parser:
         """Parse identifier."""
         identifier = self.expect_type(Identifier)
         text = identifier.text
-        if text in {"true", "false"}:
-            return Value("Boolean", text == "true")
-        if text in KEYWORDS:
-            return Value("Keyword", text)
+        next_token = self.peek()
+        lookup = next_token.text
         # Function calls are strange.
-        if self.lookup() == "(":  # Regular function call
+        if lookup == "(":  # Regular function call
             return Value(
                 "FunctionCall",
-                Value("Identifier", text),
-                Value("Arguments", *self.parse_function_arguments()),
+                (
+                    Value("Identifier", (text,)),
+                    Value("Arguments", tuple(self.parse_function_arguments())),
+                ),
             )
-        if self.lookup() == "{":  # syntactic sugar call from table constructor
+        if lookup == "{":  # syntactic sugar call from table constructor
             return Value(
                 "FunctionCall",
-                Value("Identifier", text),
-                Value("Arguments", *self.parse_table()),  # type: ignore[misc]
+                (
+                    Value("Identifier", (text,)),
+                    Value("Arguments", (self.parse_table(),)),
+                ),
             )
         if isinstance(
-            self.peek(),
+            next_token,
             StrLit,
         ):  # syntactic sugar call from string literal
             return Value(
                 "FunctionCall",
-                Value("Identifier", text),
-                Value("Arguments", *self.parse_string_literal()),  # type: ignore[misc]
+                (
+                    Value("Identifier", (text,)),
+                    Value("Arguments", (self.parse_string_literal(),)),
+                ),
             )
-        if isinstance(self.peek(), Assignment):
-            self.expect_type(Assignment)
+        if isinstance(next_token, Assignment):
+            self.next()
             return Value(
                 "Assignment",
-                Value("Identifier", text),
-                self.parse_value(),
+                (
+                    Value("Identifier", (text,)),
+                    self.parse_value(),
+                ),
             )
-        return Value("Identifier", text)
+        return Value("Identifier", (text,))
+
+    def parse_keyword(self) -> Value[Any]:
+        """Parse keyword."""
+        text = self.expect_type(Keyword).text
+        if text in {"true", "false"}:
+            return Value("Boolean", (text == "true",))
+        return Value("Keyword", (text,))
 
     def parse_comment(self) -> Value[str]:
         """Parse Comment."""
         comment = self.expect_type(Comment)
-        return Value("Comment", comment.text)
+        return Value("Comment", (comment.text,))
 
     def parse_value(self) -> Value[Any]:
         """Parse value."""
         peek = self.peek()
-        if isinstance(peek, StrLit):
-            return self.parse_string_literal()
-        if isinstance(peek, Numeric):
-            return self.parse_numeric_literal()
-        if isinstance(peek, Identifier):
-            return self.parse_identifier()
-        if isinstance(peek, Comment):
-            return self.parse_comment()
-        lookup = self.lookup()
-        if lookup == "{":
+        handler = VALUE_PARSERS.get(type(peek))
+        if handler is not None:
+            return handler(self)
+        if peek.text == "{":
             return self.parse_table()
         raise NotImplementedError(peek)
 
-
-def parse_lua_table(text: str, convert_lists: bool = True) -> object:
-    """Parse lua table from lua source."""
-    tokens = tokenize(text)
-    # print(f'{tokens = }')
-    ##for token in tokens:
-    ##    print(token)
-    parser = Parser(tokens)
-    value = parser.parse_value()
-    # print(value)
-
-    def read_value(value: Value[object]) -> object:
-        """Read value base function."""
-        assert isinstance(value, Value)
-        if value.name in {
-            "String",
-            "Boolean",
-            "Float",
-            "Integer",
-            "Identifier",
-        }:
+    def parse_value_data(self, convert_lists: bool = True) -> object:
+        """Parse value straight to the python object it represents."""
+        if self.lookup() == "{":
+            return self.parse_table_data(convert_lists)
+        value = self.parse_value()
+        if value.name in LEAF_VALUE_NAMES:
             return value.args[0]
-        if value.name == "Table":
-            return read_table(cast(Value[Value[object]], value))
-        if value.name == "Assignment":
-            return read_assignment(value)
-        if value.name == "Comment":
-            return read_comment(value)
-        if value.name == "Keyword":
-            assert isinstance(value.args[0], str)
-            return read_keyword(cast(Value[str], value))
-        raise NotImplementedError(f"{value.name} ({value})")
-
-    def read_comment(value: Value[object]) -> str:
-        assert value.name == "Comment"
-        assert isinstance(value.args[0], str)
-        return value.args[0]
-
-    def read_assignment(
-        value: Value[Any],
-    ) -> tuple[str, object]:
-        """Read an Assignment value."""
-        assert value.name == "Assignment"
-        key, data = value.args
-        return (read_value(key), read_value(data))  # type: ignore[return-value]
-
-    def read_field(
-        value: Value[object],
-        table: dict[str | int, object],
-    ) -> tuple[str | int, object]:
-        """Read a table field value."""
-        assert value.name in {"Field", "Assignment"}
-        if value.name == "Assignment":
-            return read_assignment(value)
-        # if value.name == "Indexed":
-        #    return (str(len(table)), read_value(value.args[0]))
-        if value.name == "Field":
-            field, field_value = value.args
-            assert isinstance(field, Value)
-            assert isinstance(field_value, Value)
-            read_field_obj = read_value(field)
-            assert isinstance(read_field_obj, str | int)
-            return (read_field_obj, read_value(field_value))
-        raise NotImplementedError(value.name)
-
-    def read_table(
-        value: Value[Value[object]],
+        return read_value(value, convert_lists)
+
+    def parse_table_data(
+        self,
+        convert_lists: bool = True,
     ) -> dict[str | int, object] | list[object]:
-        """Read a table and all of it's fields."""
-        assert value.name == "Table"
-        table: dict[str | int, object] = {}
-
-        last_int_key = 0
-        convert_list = convert_lists
-
-        for field in value.args:
-            key, store_value = read_field(field, table)
-            if convert_list:
-                if not isinstance(key, int):
-                    convert_list = False
-                elif key == (last_int_key + 1):
-                    last_int_key = key
+        """Parse table straight to a dictionary, without building Values.
+
+        If convert_lists is True, tables whose keys are exactly 1 to n are
+        returned as lists. Nested tables are read with an explicit stack,
+        not recursion.
+        """
+        self.expect("{")
+        # Tables still being filled, innermost last, with the next
+        # positional index for each and the key each nested table goes in
+        tables: list[dict[str | int, object]] = [{}]
+        indexes: list[int] = [1]
+        keys: list[str | int] = []
+        # Bind methods used for every field to locals
+        peek = self.peek
+        next_ = self.next
+        expect_or = self.expect_or
+        read_numeric = self.read_numeric
+        parse_value = self.parse_value
+        while True:
+            token = peek()
+            if token.text == "}":
+                next_()
+                table = tables.pop()
+                indexes.pop()
+                result: dict[str | int, object] | list[object] = table
+                if convert_lists and all(
+                    found == expect for expect, found in enumerate(table, 1)
+                ):
+                    result = list(table.values())
+                if not tables:
+                    return result
+                tables[-1][keys.pop()] = result
+            elif isinstance(token, Comment):
+                next_()
+                continue
+            else:
+                key: object
+                if token.text == "[":
+                    next_()
+                    key = self.parse_value_data(convert_lists)
+                    self.expect("]")
+                    self.expect_type(Assignment)
+                elif isinstance(token, Identifier):
+                    next_()
+                    if not isinstance(peek(), Assignment):
+                        raise NotImplementedError(f"{token.text} ({token!r})")
+                    next_()
+                    key = token.text
+                else:
+                    key = indexes[-1]
+                    indexes[-1] = key + 1
+                assert isinstance(key, str | int)
+
+                token = peek()
+                if token.text == "{":
+                    # Read the nested table's fields before this one's
+                    next_()
+                    keys.append(key)
+                    tables.append({})
+                    indexes.append(1)
+                    continue
+                # Strings, numbers and true, false and nil are common
+                # enough to read without building a Value for them first
+                token_type = type(token)
+                if token_type is StrLit:
+                    next_()
+                    tables[-1][key] = decode_string_literal(token.text)
+                elif token_type is Numeric:
+                    next_()
+                    tables[-1][key] = read_numeric(token)
+                elif token_type is Keyword and token.text in KEYWORD_VALUES:
+                    next_()
+                    tables[-1][key] = KEYWORD_VALUES[token.text]
+                else:
+                    value = parse_value()
+                    if value.name in LEAF_VALUE_NAMES:
+                        tables[-1][key] = value.args[0]
+                    else:
+                        tables[-1][key] = read_value(value, convert_lists)
+
+            # Field separator after the value, a closing brace is left for
+            # the top of the loop to handle
+            separator = peek().text
+            if separator in {",", ";"}:
+                next_()
+            elif separator != "}":
+                expect_or(FIELD_SEPARATORS)
+
+
+# Token type to method that parses a value starting with it
+VALUE_PARSERS: Final[dict[type[Token], Callable[[Parser], Value[Any]]]] = {
+    StrLit: Parser.parse_string_literal,
+    Numeric: Parser.parse_numeric_literal,
+    Identifier: Parser.parse_identifier,
+    Keyword: Parser.parse_keyword,
+    Comment: Parser.parse_comment,
+}
+
+
+# Value names whose only argument is the python object they represent
+LEAF_VALUE_NAMES: Final = frozenset(
+    {
+        "String",
+        "Boolean",
+        "Float",
+        "Integer",
+        "Identifier",
+    },
+)
+
+
+def read_value(value: Value[Any], convert_lists: bool = True) -> object:
+    """Read the python object a parsed value represents.
+
+    If convert_lists is True, tables whose keys are exactly 1 to n are
+    read as lists.
+    """
+    if value.name == "Assignment":
+        key, data = value.args
+        return (
+            read_value(key, convert_lists),
+            read_value(data, convert_lists),
+        )
+    # Tables still being filled, innermost last, with an iterator over
+    # their remaining fields. Walked with a stack instead of recursion.
+    tables: list[tuple[Iterator[Value[Any]], dict[str | int, object]]] = []
+    # Key each table in tables is waiting to read the value of
+    keys: list[str | int] = []
+    while True:
+        name = value.name
+        if name == "Table":
+            tables.append((iter(value.args), {}))
+        else:
+            if name in LEAF_VALUE_NAMES or name == "Comment":
+                result = value.args[0]
+            elif name == "Keyword" and value.args[0] == "nil":
+                result = None
+            else:
+                raise NotImplementedError(f"{name} ({value})")
+            if not tables:
+                return result
+            tables[-1][1][keys.pop()] = result
+        # Find the next field value to read, finishing any tables that
+        # have run out of fields
+        while True:
+            fields, table = tables[-1]
+            field = next(fields, None)
+            if field is None:
+                tables.pop()
+                if convert_lists and all(
+                    key == index for index, key in enumerate(table, 1)
+                ):
+                    result = list(table.values())
                 else:
-                    convert_list = False
-            table[key] = store_value
-        if not convert_list:
-            return table
-        return [table[i + 1] for i in range(len(table))]
-
-    def read_keyword(value: Value[str]) -> object:
-        if value.args[0] == "nil":
-            return None
-        raise NotImplementedError(value)
-
-    return read_value(value)
-    # return value.unpack_join()
+                    result = table
+                if not tables:
+                    return result
+                tables[-1][1][keys.pop()] = result
+                continue
+            if field.name == "Comment":
+                continue
+            if field.name not in {"Field", "Assignment"}:
+                raise NotImplementedError(field.name)
+            key, value = field.args
+            if key.name not in LEAF_VALUE_NAMES:
+                raise NotImplementedError(f"{key.name} key ({key})")
+            key_obj = key.args[0]
+            assert isinstance(key_obj, str | int)
+            keys.append(key_obj)
+            break
+
+
+@functools.lru_cache(maxsize=256)
+def cached_parse_lua_table(text: str, convert_lists: bool = True) -> object:
+    """Parse lua table from lua source, remembering recent results.
+
+    Returned objects are shared between calls and must not be mutated,
+    use parse_lua_table to get a private copy.
+    """
+    # Tokens are read as the parser needs them, no full token list
+    parser = Parser(tokenize_iter(text))
+    # Tables are read straight to data, skipping the Value tree
+    value = parser.parse_value_data(convert_lists)
+    # Tokens are lazy, so check nothing but comments follows the value
+    parser.expect_end()
+    return value
+
+
+def parse_lua_table(text: str, convert_lists: bool = True) -> object:
+    """Parse lua table from lua source."""
+    # Copying a cached result is much cheaper than parsing it again
+    return copy.deepcopy(cached_parse_lua_table(text, convert_lists))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,522 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+from urllib.parse import parse_qsl
+
+import httpx
+import pytest
+import trio
+
+import market_api
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable, Iterator
+
+PUBLICATION = (
+    '{success=true, result={file_id=5, publication_name="p", '
+    'user_name="u", version=1, category_id=1, source_url="s", path="p", '
+    'license_id=1, timestamp=0, initial_description="", '
+    'translated_description="", dependencies={7}, all_dependencies={7}, '
+    'dependencies_data={[7]={source_url="x", path="y", version=1, '
+    "type_id=1}}}}"
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_caches() -> Iterator[None]:
+    market_api.clear_search_cache()
+    market_api.clear_publication_cache()
+    market_api.MAX_COUNT_CACHE.clear()
+    yield
+    market_api.clear_search_cache()
+    market_api.clear_publication_cache()
+    market_api.MAX_COUNT_CACHE.clear()
+
+
+def run_with(
+    handler: Callable[[httpx.Request], httpx.Response],
+    function: Callable[[httpx.AsyncClient], Awaitable[object]],
+) -> object:
+    """Return result of function run with client that handler answers."""
+
+    async def main() -> object:
+        transport = httpx.MockTransport(handler)
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await function(client)
+
+    return trio.run(main)
+
+
+def form(request: httpx.Request) -> dict[str, str]:
+    return dict(parse_qsl(request.content.decode()))
+
+
+def search_result(file_ids: range) -> str:
+    items = ",".join(
+        f'{{file_id={file_id}, publication_name="p{file_id}", '
+        'user_name="u", version=1, category_id=1, reviews_count=0, '
+        "downloads=3}"
+        for file_id in file_ids
+    )
+    return f"{{success=true, result={{{items}}}}}"
+
+
+def market_server(
+    total: int,
+    cap: int,
+    requests: list[dict[str, str]],
+) -> Callable[[httpx.Request], httpx.Response]:
+    """Return handler for a category of total publications.
+
+    Like the real server, returns at most cap publications per request.
+    """
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        data = form(request)
+        requests.append(data)
+        offset = int(data.get("offset", 0))
+        count = min(int(data["count"]), cap)
+        file_ids = range(offset, min(offset + count, total))
+        return httpx.Response(200, text=search_result(file_ids))
+
+    return handler
+
+
+def test_get_publication_cached_copy() -> None:
+    requests: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, text=PUBLICATION)
+
+    async def function(client: httpx.AsyncClient) -> None:
+        first = await market_api.get_publication(client, 5, 18)
+        assert first.dependencies == [7]
+        first.dependencies_data.clear()
+        assert first.dependencies is not None
+        first.dependencies.append(8)
+
+        second = await market_api.get_publication(client, 5, 18)
+        assert len(requests) == 1
+        assert second.dependencies == [7]
+        assert second.all_dependencies == [7]
+        assert list(second.dependencies_data) == [7]
+        assert second.dependencies_data[7].path == "y"
+
+        market_api.clear_publication_cache(5)
+        await market_api.get_publication(client, 5, 18)
+        assert len(requests) == 2
+
+    run_with(handler, function)
+    assert form(requests[0]) == {"file_id": "5", "language_id": "18"}
+
+
+@pytest.mark.parametrize(
+    "cls",
+    [
+        value
+        for value in vars(market_api).values()
+        if isinstance(value, type)
+        and issubclass(value, tuple)
+        and hasattr(value, "_fields")
+    ],
+)
+def test_result_types_have_no_instance_dict(cls: type[tuple[object]]) -> None:
+    assert "__dict__" not in dir(cls)
+    assert "__slots__" in vars(cls)
+
+
+def test_publication_has_no_instance_dict() -> None:
+    async def function(client: httpx.AsyncClient) -> object:
+        return await market_api.get_publication(client, 5, 18)
+
+    publication = run_with(respond(PUBLICATION), function)
+    assert isinstance(publication, market_api.Publication)
+    assert not hasattr(publication, "__dict__")
+    assert not hasattr(publication.dependencies_data[7], "__dict__")
+
+
+@pytest.mark.parametrize(
+    ("total", "cap", "batch_size", "probe_requests"),
+    [
+        (120, 50, 8, 10),
+        (120, 50, 1, 3),
+        (70, 50, 8, 2),
+        (150, 100, 8, 2),
+        (200, 100, 8, 10),
+        (200, 100, 2, 4),
+        (30, 100, 8, 2),
+        (100, 100, 8, 2),
+        (2500, 1000, 8, 9),
+        (0, 100, 8, 1),
+    ],
+)
+def test_get_all_publications(
+    total: int,
+    cap: int,
+    batch_size: int,
+    probe_requests: int,
+) -> None:
+    requests: list[dict[str, str]] = []
+    handler = market_server(total, cap, requests)
+
+    async def function(client: httpx.AsyncClient) -> None:
+        category = market_api.PublicationCategory.APPLICATIONS
+        for call in range(2):
+            result = await market_api.get_all_publications(
+                client,
+                category,
+                batch_size=batch_size,
+            )
+            assert sorted(result) == list(range(total))
+            assert all(result[key].file_id == key for key in result)
+            market_api.clear_search_cache()
+            if call == 0:
+                # Only the first call has to probe
+                assert len(requests) == probe_requests
+        if total > cap:
+            assert market_api.MAX_COUNT_CACHE[client] == cap
+        else:
+            assert client not in market_api.MAX_COUNT_CACHE
+
+    run_with(handler, function)
+    assert requests[0]["count"] == str(market_api.MAX_COUNT_PROBE)
+    assert all(data["category_id"] == "1" for data in requests)
+
+
+def test_get_all_publications_per_request() -> None:
+    requests: list[dict[str, str]] = []
+    handler = market_server(45, 100, requests)
+
+    async def function(client: httpx.AsyncClient) -> object:
+        return await market_api.get_all_publications(
+            client,
+            market_api.PublicationCategory.APPLICATIONS,
+            per_request=10,
+            batch_size=3,
+        )
+
+    result = run_with(handler, function)
+    assert isinstance(result, dict)
+    assert sorted(result) == list(range(45))
+    # Pages in a batch are requested at the same time, in any order
+    assert sorted(int(data["offset"]) for data in requests) == list(
+        range(0, 60, 10),
+    )
+
+
+@pytest.mark.parametrize("fail_offset", [0, 10, 30, 70])
+def test_get_all_publications_page_fails(fail_offset: int) -> None:
+    requests: list[dict[str, str]] = []
+    server = market_server(500, 100, requests)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if form(request).get("offset") == str(fail_offset):
+            requests.append(form(request))
+            text = '{success=false, reason="Too many requests"}'
+            return httpx.Response(200, text=text)
+        return server(request)
+
+    async def function(client: httpx.AsyncClient) -> object:
+        return await market_api.get_all_publications(
+            client,
+            market_api.PublicationCategory.APPLICATIONS,
+            per_request=10,
+            batch_size=4,
+        )
+
+    with pytest.raises(market_api.APIError) as result:
+        run_with(handler, function)
+    assert str(result.value) == "Too many requests"
+    # The batch with the failing page is the last one requested
+    assert max(int(data["offset"]) for data in requests) < fail_offset + 40
+
+
+@pytest.mark.parametrize(
+    ("per_request", "batch_size"),
+    [(0, 8), (-1, 8), (None, 0), (10, -1)],
+)
+def test_get_all_publications_invalid(
+    per_request: int | None,
+    batch_size: int,
+) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise AssertionError("No request should be made")
+
+    async def function(client: httpx.AsyncClient) -> object:
+        return await market_api.get_all_publications(
+            client,
+            market_api.PublicationCategory.APPLICATIONS,
+            per_request=per_request,
+            batch_size=batch_size,
+        )
+
+    with pytest.raises(ValueError, match="must be positive"):
+        run_with(handler, function)
+
+
+def respond(
+    text: str,
+    content_type: str = "text/plain",
+) -> Callable[[httpx.Request], httpx.Response]:
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            200,
+            text=text,
+            headers={"content-type": content_type},
+        )
+
+    return handler
+
+
+def request_script(
+    handler: Callable[[httpx.Request], httpx.Response],
+    html_raise_exception: bool = True,
+) -> object:
+    async def function(client: httpx.AsyncClient) -> object:
+        return await market_api.api_request(
+            client,
+            "statistics",
+            html_raise_exception=html_raise_exception,
+        )
+
+    return run_with(handler, function)
+
+
+def parse_not_allowed(text: str) -> object:
+    raise AssertionError("Failure response should not be parsed")
+
+
+@pytest.mark.parametrize(
+    ("text", "reason"),
+    [
+        ('{success=false, reason="Too many requests"}', "Too many requests"),
+        ('{reason="Too many requests",success=false}', "Too many requests"),
+        (' { success = false ; reason = "" ; } \n', ""),
+        ("{success=false}", market_api.NO_REASON),
+    ],
+)
+def test_api_request_failure_short_circuit(
+    monkeypatch: pytest.MonkeyPatch,
+    text: str,
+    reason: str,
+) -> None:
+    monkeypatch.setattr(
+        market_api.lua_parser,
+        "parse_lua_table",
+        parse_not_allowed,
+    )
+    with pytest.raises(market_api.APIError) as result:
+        request_script(respond(text))
+    assert str(result.value) == reason
+
+
+@pytest.mark.parametrize(
+    ("text", "reason"),
+    [
+        ('{success=false, reason="Bad \\"token\\""}', 'Bad "token"'),
+        ('{success=false, reason="Gone", code=404}', "Gone"),
+        ("{success=false, result={}}", market_api.NO_REASON),
+    ],
+)
+def test_api_request_failure_parsed(text: str, reason: str) -> None:
+    with pytest.raises(market_api.APIError) as result:
+        request_script(respond(text))
+    assert str(result.value) == reason
+
+
+def test_api_request_success() -> None:
+    result = request_script(respond('{success=true, result={a="b"}}'))
+    assert result == {"success": True, "result": {"a": "b"}}
+
+
+@pytest.mark.parametrize(
+    ("text", "content_type"),
+    [
+        (
+            "<!DOCTYPE html><html><head><title>Oops</title></head></html>",
+            "text/html; charset=utf-8",
+        ),
+        ("<HTML lang=en><TITLE>Oops</TITLE></HTML>", "text/plain"),
+        ("Warning: db down\n<html><title>Oops</title></html>", "text/html"),
+        ("<html><title>Oops</title></html>", "application/json"),
+    ],
+)
+def test_api_request_html(text: str, content_type: str) -> None:
+    handler = respond(text, content_type)
+    with pytest.raises(market_api.APIError) as result:
+        request_script(handler)
+    assert str(result.value) == 'Got HTML page "Oops", not MineOS data'
+    assert request_script(handler, html_raise_exception=False) == {
+        "html": text,
+    }
+
+
+def test_api_request_html_no_title() -> None:
+    text = "<html><body>Gateway Timeout</body></html>"
+    with pytest.raises(market_api.APIError) as result:
+        request_script(respond(text, "text/html"))
+    assert str(result.value) == f'Got HTML page "{text}", not MineOS data'
+
+
+def test_api_request_not_html() -> None:
+    with pytest.raises(market_api.lua_parser.ParseError):
+        request_script(respond("<oops>", "text/html"))
+
+
+def test_get_publications_cache() -> None:
+    requests: list[dict[str, str]] = []
+    handler = market_server(3, 100, requests)
+
+    async def function(client: httpx.AsyncClient) -> None:
+        first = await market_api.get_publications(client, search="p")
+        first.clear()
+        assert len(await market_api.get_publications(client, search="p")) == 3
+        assert len(requests) == 1
+
+        # Misses are remembered too
+        assert not await market_api.get_publications(client, offset=10)
+        assert not await market_api.get_publications(client, offset=10)
+        assert len(requests) == 2
+
+        await market_api.get_publications(client, search="p", count=2)
+        assert len(requests) == 3
+
+        market_api.clear_search_cache()
+        await market_api.get_publications(client, search="p")
+        assert len(requests) == 4
+
+    run_with(handler, function)
+
+
+def update(client: httpx.AsyncClient) -> Awaitable[object]:
+    return market_api.update_publication(
+        client,
+        "token",
+        5,
+        "name",
+        "url",
+        "path",
+        "description",
+        1,
+        market_api.PublicationCategory.APPLICATIONS,
+    )
+
+
+def upload(client: httpx.AsyncClient) -> Awaitable[object]:
+    return market_api.upload_publication(
+        client,
+        "token",
+        "name",
+        "url",
+        "path",
+        "description",
+        1,
+        market_api.PublicationCategory.APPLICATIONS,
+    )
+
+
+def delete(client: httpx.AsyncClient) -> Awaitable[object]:
+    return market_api.delete_publication(client, "token", 5)
+
+
+@pytest.mark.parametrize(
+    ("change", "clears_publication"),
+    [(update, True), (upload, False), (delete, True)],
+)
+def test_changes_clear_caches(
+    change: Callable[[httpx.AsyncClient], Awaitable[object]],
+    clears_publication: bool,
+) -> None:
+    scripts: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        script = request.url.path.rsplit("/", 1)[-1].removesuffix(".php")
+        scripts.append(script)
+        if script == "publications":
+            return httpx.Response(200, text=search_result(range(3)))
+        if script == "publication":
+            return httpx.Response(200, text=PUBLICATION)
+        return httpx.Response(200, text="{success=true}")
+
+    async def function(client: httpx.AsyncClient) -> None:
+        for _ in range(2):
+            await market_api.get_publications(client)
+            await market_api.get_publication(client, 5, 18)
+            await market_api.get_publication(client, 6, 18)
+        assert scripts == ["publications", "publication", "publication"]
+
+        await change(client)
+        assert not market_api.SEARCH_CACHE
+        assert ((5, 18) not in market_api.PUBLICATION_CACHE) is (
+            clears_publication
+        )
+        assert (6, 18) in market_api.PUBLICATION_CACHE
+
+        await market_api.get_publications(client)
+        await market_api.get_publication(client, 5, 18)
+        expect = ["publications", "publication"][: 1 + clears_publication]
+        assert scripts[4:] == expect
+
+    run_with(handler, function)
+
+
+def test_pretty_format_response() -> None:
+    response = {
+        "result": [
+            market_api.Dependency("s", "p", 1, market_api.FileType.MAIN),
+            {1: (), 2: set(), 3: [], 4: {}},
+            {"a\nb"},
+        ],
+        "x": (1,),
+    }
+    assert market_api.pretty_format_response(response) == (
+        "{\n"
+        "  'result': [\n"
+        "    (\n"
+        "      source_url = 's',\n"
+        "      path = 'p',\n"
+        "      version = 1,\n"
+        "      type_id = <FileType.MAIN: 1>,\n"
+        "      publication_name = None,\n"
+        "      category_id = None\n"
+        "    ),\n"
+        "    {\n"
+        "      1: (),\n"
+        "      2: set(),\n"
+        "      3: [],\n"
+        "      4: {}\n"
+        "    },\n"
+        "    {\n"
+        "      'a\\nb'\n"
+        "    }\n"
+        "  ],\n"
+        "  'x': (\n"
+        "    1\n"
+        "  )\n"
+        "}"
+    )
+
+
+@pytest.mark.parametrize(
+    ("response", "expect"),
+    [({}, "{}"), ([], "[]"), (set(), "set()"), ((), "()")],
+)
+def test_pretty_format_response_empty(
+    response: dict[str, object] | list[object] | set[object] | tuple[()],
+    expect: str,
+) -> None:
+    assert market_api.pretty_format_response(response) == expect
+
+
+def test_headers() -> None:
+    with pytest.raises(TypeError):
+        market_api.HEADERS["User-Agent"] = "changed"  # type: ignore[index]
+    sent: list[httpx.Headers] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent.append(request.headers)
+        return httpx.Response(200, text="{success=true}")
+
+    run_with(handler, lambda client: market_api.api_request(client, "a"))
+    assert sent[0]["user-agent"] == market_api.AGENT
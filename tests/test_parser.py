@@ -10,7 +10,7 @@ from market_api import lua_parser
         ("-3.0", "Float[-3.0]"),
         ("3.1416", "Float[3.1416]"),
         ("314.16e-2", "Float[3.1416]"),
-        ("0.31416E1", "Float[0.31416]"),
+        ("0.31416E1", "Float[3.1416]"),
         ("34e1", "Float[340.0]"),
         ("0x0.1E", "Float[0.1171875]"),
         ("0xA23p-4", "Float[162.1875]"),
@@ -42,7 +42,7 @@ def test_tokenization() -> None:
         "Assignment[Identifier['a'], String['also\\n123\"']]"
     )
     assert str(parser.parse_identifier()) == (
-        "Assignment[Identifier['a'], String['97lo1004923\"']]"
+        "Assignment[Identifier['a'], String['alo\\n123\"']]"
     )
     assert str(parser.parse_identifier()) == (
         "Assignment[Identifier['c'], Float[3.141592653589793]]"
@@ -58,6 +58,108 @@ def test_tokenization() -> None:
     )
 
 
+@pytest.mark.parametrize(
+    ("code", "expect"),
+    [
+        ("'\\x41\\x62c'", "Abc"),
+        ("'\\65\\0661'", "AB1"),
+        ("'\\\\x41'", "\\x41"),
+        ("'\\q\\''", "q'"),
+    ],
+)
+def test_string_escapes(code: str, expect: str) -> None:
+    parser = lua_parser.Parser(lua_parser.tokenize(code))
+    assert parser.parse_string_literal().args == (expect,)
+
+
+def test_tokenize_positions() -> None:
+    tokens = lua_parser.tokenize('a = "x\\\\"\n  b = 2 -- note\n')
+    assert [(type(t).__name__, t.text, t.line, t.column) for t in tokens] == [
+        ("Identifier", "a", 1, 0),
+        ("Assignment", "=", 1, 2),
+        ("StrLit", '"x\\\\"', 1, 4),
+        ("Identifier", "b", 2, 2),
+        ("Assignment", "=", 2, 4),
+        ("Numeric", "2", 2, 6),
+        ("Comment", "-- note", 2, 8),
+        ("End", "", 3, 0),
+    ]
+
+
+def test_keywords() -> None:
+    tokens = lua_parser.tokenize("{true, nil, x}")
+    assert [type(t).__name__ for t in tokens[1:-2:2]] == [
+        "Keyword",
+        "Keyword",
+        "Identifier",
+    ]
+    assert lua_parser.parse_lua_table("{true, nil, 3}") == [True, None, 3]
+
+
+def test_tokenize_invalid() -> None:
+    with pytest.raises(lua_parser.ParseError, match="Could not parse"):
+        lua_parser.tokenize("a = 'unterminated")
+
+
+@pytest.mark.parametrize("code", ["{a=1} junk @", "{a=1} junk", "{a=1} {}"])
+def test_parse_trailing_input(code: str) -> None:
+    with pytest.raises(lua_parser.ParseError):
+        lua_parser.parse_lua_table(code)
+
+
+def test_parse_trailing_comment() -> None:
+    assert lua_parser.parse_lua_table("{a=1} -- done\n") == {"a": 1}
+
+
+@pytest.mark.parametrize(
+    ("code", "expect"),
+    [
+        (
+            "f{1}",
+            "FunctionCall[Identifier['f'], Arguments[Table[Field[Integer[1], Integer[1]]]]]",
+        ),
+        (
+            "f'x'",
+            "FunctionCall[Identifier['f'], Arguments[String['x']]]",
+        ),
+    ],
+)
+def test_sugar_function_calls(code: str, expect: str) -> None:
+    parser = lua_parser.Parser(lua_parser.tokenize(code))
+    assert str(parser.parse_identifier()) == expect
+
+
+def test_value_equality() -> None:
+    value = lua_parser.Value("Integer", (1,))
+    assert value == lua_parser.Value("Integer", (1,))
+    assert value != lua_parser.Value("Float", (1,))
+    assert value != ("Integer", (1,))
+    assert len({value, lua_parser.Value("Integer", (1,))}) == 1
+
+
+def test_parse_cached_copies() -> None:
+    first = lua_parser.parse_lua_table("{a = {1, 2}}")
+    assert isinstance(first, dict)
+    first["a"].append(3)
+    assert lua_parser.parse_lua_table("{a = {1, 2}}") == {"a": [1, 2]}
+
+
+def test_table_comments_skipped() -> None:
+    code = "{1, -- one\n 2, -- two\n}"
+    assert lua_parser.parse_lua_table(code) == [1, 2]
+
+
+def test_parse_table_data_lists() -> None:
+    assert lua_parser.parse_lua_table("{[1] = 'a', [3] = 'b'}") == {
+        1: "a",
+        3: "b",
+    }
+    assert lua_parser.parse_lua_table("{'a', {}}", convert_lists=False) == {
+        1: "a",
+        2: {},
+    }
+
+
 def test_weather_table() -> None:
     assert (
         lua_parser.parse_lua_table(